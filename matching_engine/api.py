@@ -1,133 +1,245 @@
-from fastapi import FastAPI, WebSocket, WebSocketDisconnect
-from pydantic import BaseModel
+from fastapi import FastAPI, HTTPException, Request, Response, WebSocket, WebSocketDisconnect
+from fastapi.responses import JSONResponse
+import msgspec
+from contextlib import asynccontextmanager
 from decimal import Decimal
-from typing import Optional, List, Dict
-import json
-from datetime import datetime
+from typing import Optional, List, Dict, Literal, Set
+import orjson
+import time
 import asyncio
-from .engine import MatchingEngine
-import uuid
+from .engine import PRICE_SCALE, QTY_SCALE, from_fixed, to_fixed
+from .shards import Depth, ShardedEngine, ShardError
 
-app = FastAPI(title="Cryptocurrency Matching Engine")
+# Initializing, order books live in per-symbol shard processes
+engine = ShardedEngine()
 
-# Initializing
-engine = MatchingEngine()
+@asynccontextmanager
+async def lifespan(app: FastAPI):
+    # we can Stop the shard workers when the server shuts down
+    yield
+    engine.close()
+
+app = FastAPI(title="Cryptocurrency Matching Engine", lifespan=lifespan)
 
 # storeage
-market_data_connections: List[WebSocket] = []
-trade_connections: List[WebSocket] = []
+market_data_connections: Set[WebSocket] = set()
+trade_connections: Set[WebSocket] = set()
+client_queues: Dict[WebSocket, asyncio.Queue] = {}  # outbound messages per client
+client_writers: Dict[WebSocket, asyncio.Task] = {}  # writer task per client
+_closing: Set[asyncio.Task] = set()  # close handshakes for clients dropped as too slow
+
+# we can Coalesce outbound messages into one frame per client every few ms
+BATCH_MAX_MESSAGES = 50
+BATCH_INTERVAL = 0.005  # seconds
+CLIENT_QUEUE_SIZE = 256  # messages buffered per client before it counts as too slow
+SLOW_CLIENT_CLOSE_CODE = 1013  # "try again later"
 
-class OrderRequest(BaseModel):
+class OrderRequest(msgspec.Struct):
     symbol: str
-    order_type: str
-    side: str
+    order_type: Literal["market", "limit", "ioc", "fok"]
+    side: Literal["buy", "sell"]
     quantity: Decimal
     price: Optional[Decimal] = None
 
-class OrderResponse(BaseModel):
+    def __post_init__(self):
+        # we can Check amounts here, msgspec.Meta(gt=0) does not apply to Decimal fields
+        if not (self.quantity.is_finite() and self.quantity > 0):
+            raise ValueError("quantity must be a number greater than 0")
+        if self.price is not None and not (self.price.is_finite() and self.price > 0):
+            raise ValueError("price must be a number greater than 0")
+        if self.order_type == "limit" and self.price is None:
+            raise ValueError("limit order requires a price")
+        # we can Reject amounts the fixed-point book cannot hold exactly before they reach a shard
+        to_fixed(self.quantity, QTY_SCALE)
+        if self.price is not None:
+            to_fixed(self.price, PRICE_SCALE)
+
+class OrderResponse(msgspec.Struct):
     order_id: str
     status: str
-    executions: List[Dict]
-
-@app.post("/order", response_model=OrderResponse)
-async def submit_order(order: OrderRequest):
-    executions = engine.submit_order(
-        symbol=order.symbol,
-        side=order.side,
-        order_type=order.order_type,
-        quantity=order.quantity,
-        price=order.price
-    )
+    executions: List[Dict[str, str]]
+
+@app.exception_handler(ShardError)
+async def shard_error_handler(request: Request, exc: ShardError):
+    return JSONResponse(status_code=503, content={"detail": str(exc)})
+
+@app.post("/order")
+async def submit_order(request: Request):
+    # we can Decode and validate the body with msgspec instead of a pydantic model
+    try:
+        order = msgspec.json.decode(await request.body(), type=OrderRequest)
+    except msgspec.DecodeError as exc:
+        raise HTTPException(status_code=422, detail=str(exc))
+    
+    try:
+        order_id, fills, depth = await engine.submit_order(
+            symbol=order.symbol,
+            side=order.side,
+            order_type=order.order_type,
+            quantity=order.quantity,
+            price=order.price
+        )
+    except ValueError as exc:
+        # we can Answer orders the engine rejected as bad input, its book is untouched
+        raise HTTPException(status_code=422, detail=str(exc))
     
     # we can Broadcast market data updates
-    await broadcast_market_data(order.symbol)
+    broadcast_market_data(order.symbol, depth)
     
     # we can Broadcast trade executions
-    for maker, taker, price, quantity in executions:
+    for maker_order_id, taker_order_id, aggressor_side, price, quantity in fills:
         trade_data = {
-            "timestamp": datetime.utcnow().isoformat(),
+            "timestamp": time.time_ns(),
             "symbol": order.symbol,
-            "trade_id": f"{maker.order_id}-{taker.order_id}",
-            "price": str(price),
-            "quantity": str(quantity),
-            "aggressor_side": taker.side,
-            "maker_order_id": maker.order_id,
-            "taker_order_id": taker.order_id
+            "trade_id": f"{maker_order_id}-{taker_order_id}",
+            "price": str(from_fixed(price, PRICE_SCALE)),
+            "quantity": str(from_fixed(quantity, QTY_SCALE)),
+            "aggressor_side": aggressor_side,
+            "maker_order_id": str(maker_order_id),
+            "taker_order_id": str(taker_order_id)
         }
-        await broadcast_trade(trade_data)
-    
-    # we can Get the order ID from the taker order if there are executions, otherwise from the maker order
-    order_id = executions[0][1].order_id if executions else None
+        broadcast_trade(trade_data)
     
-    return OrderResponse(
-        order_id=order_id or str(uuid.uuid4()),  # Generate new ID if no executions
-        status="filled" if executions else "accepted",
+    response = OrderResponse(
+        order_id=str(order_id),
+        status="filled" if fills else "accepted",
         executions=[{
-            "price": str(price),
-            "quantity": str(qty),
-            "maker_order_id": maker.order_id,
-            "taker_order_id": taker.order_id
-        } for maker, taker, price, qty in executions]
+            "price": str(from_fixed(price, PRICE_SCALE)),
+            "quantity": str(from_fixed(qty, QTY_SCALE)),
+            "maker_order_id": str(maker_order_id),
+            "taker_order_id": str(taker_order_id)
+        } for maker_order_id, taker_order_id, _, price, qty in fills]
     )
+    return Response(content=msgspec.json.encode(response), media_type="application/json")
 
 @app.delete("/order/{symbol}/{order_id}")
-async def cancel_order(symbol: str, order_id: str):
-    success = engine.cancel_order(symbol, order_id)
+async def cancel_order(symbol: str, order_id: int):
+    success, depth = await engine.cancel_order(symbol, order_id)
     if success:
-        await broadcast_market_data(symbol)
+        broadcast_market_data(symbol, depth)
     return {"success": success}
 
 @app.get("/bbo/{symbol}")
 async def get_bbo(symbol: str):
-    best_bid, best_ask = engine.get_bbo(symbol)
+    best_bid, best_ask = await engine.get_bbo(symbol)
     return {
         "symbol": symbol,
-        "best_bid": str(best_bid) if best_bid else None,
-        "best_ask": str(best_ask) if best_ask else None
+        "best_bid": str(from_fixed(best_bid, PRICE_SCALE)) if best_bid is not None else None,
+        "best_ask": str(from_fixed(best_ask, PRICE_SCALE)) if best_ask is not None else None
     }
 
-async def broadcast_market_data(symbol: str):
-    order_book = engine.get_order_book(symbol)
-    best_bid, best_ask = order_book.get_bbo()
-    
+def broadcast_market_data(symbol: str, depth: Depth):
+    bids, asks = depth
     market_data = {
-        "timestamp": datetime.utcnow().isoformat(),
+        "timestamp": time.time_ns(),
         "symbol": symbol,
-        "asks": [[str(price), str(sum(o.quantity for o in orders))] 
-                for price, orders in sorted(order_book.asks.items())[:10]],
-        "bids": [[str(price), str(sum(o.quantity for o in orders))] 
-                for price, orders in sorted(order_book.bids.items(), reverse=True)[:10]]
+        "asks": [[str(from_fixed(price, PRICE_SCALE)), str(from_fixed(quantity, QTY_SCALE))]
+                for price, quantity in asks],
+        "bids": [[str(from_fixed(price, PRICE_SCALE)), str(from_fixed(quantity, QTY_SCALE))]
+                for price, quantity in bids]
     }
     
-    for connection in market_data_connections:
-        try:
-            await connection.send_json(market_data)
-        except WebSocketDisconnect:
-            market_data_connections.remove(connection)
+    # we can Serialize once and share the same bytes with every client
+    # a newer snapshot supersedes older ones, so slow clients just skip the oldest
+    fanout(market_data_connections, orjson.dumps(market_data), drop_oldest=True)
 
-async def broadcast_trade(trade_data: dict):
-    for connection in trade_connections:
+def broadcast_trade(trade_data: dict):
+    # we can Never lose a fill; a client that cannot keep up is disconnected instead
+    fanout(trade_connections, orjson.dumps(trade_data), drop_oldest=False)
+
+def fanout(connections: Set[WebSocket], payload: bytes, drop_oldest: bool):
+    """
+    we can Queue payload for every client without blocking, then sweep out dead clients
+    On a full queue the oldest message is dropped if drop_oldest, otherwise the client is disconnected
+    """
+    dead = set()
+    for connection in connections:
+        queue = client_queues.get(connection)
+        if queue is None:
+            dead.add(connection)
+            continue
         try:
-            await connection.send_json(trade_data)
-        except WebSocketDisconnect:
-            trade_connections.remove(connection)
+            queue.put_nowait(payload)
+        except asyncio.QueueFull:
+            if drop_oldest:
+                _drop_oldest(queue, payload)
+            else:
+                _disconnect_slow_client(connection)
+                dead.add(connection)
+    if dead:
+        connections -= dead
 
-@app.websocket("/ws/market-data")
-async def market_data_websocket(websocket: WebSocket):
-    await websocket.accept()
-    market_data_connections.append(websocket)
+def _drop_oldest(queue: asyncio.Queue, message: bytes):
+    """we can Make room for the newest message on a full queue by dropping the oldest one"""
+    try:
+        queue.get_nowait()
+    except asyncio.QueueEmpty:
+        pass
+    queue.put_nowait(message)
+
+def _disconnect_slow_client(websocket: WebSocket):
+    """we can Stop feeding a client and close it with SLOW_CLIENT_CLOSE_CODE"""
+    client_queues.pop(websocket, None)
+    writer = client_writers.pop(websocket, None)
+    if writer is not None:
+        writer.cancel()
+    task = asyncio.get_running_loop().create_task(_close(websocket))
+    _closing.add(task)
+    task.add_done_callback(_closing.discard)
+
+async def _close(websocket: WebSocket):
+    try:
+        await websocket.close(code=SLOW_CLIENT_CLOSE_CODE, reason="client too slow")
+    except (RuntimeError, WebSocketDisconnect):
+        pass
+
+async def client_writer(websocket: WebSocket, queue: asyncio.Queue):
+    """
+    we can Send a client's queued messages in microbatches
+    A batch of more than one message goes out as {"type": "multi", "payload": [...]},
+    spliced together from the already-encoded messages
+    """
     try:
         while True:
-            await websocket.receive_text()
+            batch = [await queue.get()]
+            await asyncio.sleep(BATCH_INTERVAL)
+            while len(batch) < BATCH_MAX_MESSAGES and not queue.empty():
+                batch.append(queue.get_nowait())
+            
+            if len(batch) == 1:
+                frame = batch[0]
+            else:
+                frame = b'{"type":"multi","payload":[' + b",".join(batch) + b"]}"
+            await websocket.send_bytes(frame)
     except WebSocketDisconnect:
-        market_data_connections.remove(websocket)
+        pass
+    finally:
+        # we can Mark the client dead for the next broadcast sweep
+        client_queues.pop(websocket, None)
 
-@app.websocket("/ws/trades")
-async def trades_websocket(websocket: WebSocket):
+async def serve_subscriber(websocket: WebSocket, connections: Set[WebSocket]):
+    """we can Register a client for broadcasts until it disconnects"""
     await websocket.accept()
-    trade_connections.append(websocket)
+    queue: asyncio.Queue = asyncio.Queue(maxsize=CLIENT_QUEUE_SIZE)
+    client_queues[websocket] = queue
+    writer = asyncio.create_task(client_writer(websocket, queue))
+    client_writers[websocket] = writer
+    connections.add(websocket)
     try:
         while True:
             await websocket.receive_text()
     except WebSocketDisconnect:
-        trade_connections.remove(websocket) 
\ No newline at end of file
+        pass
+    finally:
+        connections.discard(websocket)
+        client_queues.pop(websocket, None)
+        client_writers.pop(websocket, None)
+        writer.cancel()
+
+@app.websocket("/ws/market-data")
+async def market_data_websocket(websocket: WebSocket):
+    await serve_subscriber(websocket, market_data_connections)
+
+@app.websocket("/ws/trades")
+async def trades_websocket(websocket: WebSocket):
+    await serve_subscriber(websocket, trade_connections) 
\ No newline at end of file
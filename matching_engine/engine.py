@@ -1,166 +1,372 @@
-from decimal import Decimal
+from decimal import Decimal, DecimalException, Inexact, localcontext
 from typing import Dict, List, Optional, Tuple
 from dataclasses import dataclass
-from datetime import datetime
-import uuid
+import itertools
+import time
+from sortedcontainers import SortedDict
+
+# we can Keep prices and quantities as fixed-point ints inside the book
+PRICE_SCALE = 10**8  # price ticks per unit of quote currency
+QTY_SCALE = 10**8  # quantity lots per unit of base currency
+
+def to_fixed(value: Decimal, scale: int) -> int:
+    """we can Convert a decimal amount to integer ticks/lots, rejecting anything finer than one tick/lot"""
+    try:
+        with localcontext() as ctx:
+            ctx.traps[Inexact] = True  # we can Refuse amounts with more digits than the context keeps
+            scaled = value * scale
+            fixed = int(scaled)
+    except (DecimalException, OverflowError):
+        # we can Report bad amounts as a rejected order, not as a failure inside the book
+        raise ValueError(f"amount {value} is out of range") from None
+    if fixed != scaled:
+        raise ValueError(f"amount {value} is not a multiple of 1/{scale}")
+    return fixed
+
+def from_fixed(value: int, scale: int) -> Decimal:
+    """we can Convert integer ticks/lots back to a decimal amount"""
+    return Decimal(value) / scale
 
 @dataclass
 class Order:
-    order_id: str
+    order_id: int
     symbol: str
     side: str  # "buy" or "sell"
     order_type: str  # "market", "limit", "ioc", "fok"
-    quantity: Decimal
-    price: Optional[Decimal]
-    timestamp: datetime
+    quantity: int  # lots, see QTY_SCALE
+    price: Optional[int]  # ticks, see PRICE_SCALE
+    timestamp: int  # nanoseconds since the epoch
+
+# (maker_order, taker_order, price, quantity)
+Execution = Tuple[Order, Order, int, int]
+
+# we can Leave the high bits of order ids for the issuing engine's prefix
+ORDER_ID_SHIFT = 48
+
+# we can Cap how many idle executions buffers the engine keeps around
+EXEC_POOL_SIZE = 64
+
+# we can Keep this many levels per side in the order book's depth snapshot
+DEPTH_LEVELS = 10
+
+# we can Size new price levels for a handful of orders; they double when full
+LEVEL_CAPACITY = 8
+NIL = -1  # empty slot link
+
+class PriceLevel:
+    """
+    we can FIFO of resting orders at one price, kept in preallocated slots
+    Slots are linked by index (next/prev), so cancels unlink in O(1) and
+    freed slots are reused instead of allocating new nodes
+    """
+    __slots__ = ("orders", "next", "prev", "head", "tail", "free", "count")
+
+    def __init__(self, capacity: int = LEVEL_CAPACITY):
+        self.orders: List[Optional[Order]] = [None] * capacity
+        self.next: List[int] = list(range(1, capacity)) + [NIL]  # also chains the free list
+        self.prev: List[int] = [NIL] * capacity
+        self.head = NIL
+        self.tail = NIL
+        self.free = 0
+        self.count = 0
+
+    def __len__(self) -> int:
+        return self.count
+
+    def __iter__(self):
+        slot = self.head
+        while slot != NIL:
+            yield self.orders[slot]
+            slot = self.next[slot]
+
+    def append(self, order: Order) -> int:
+        """we can Queue an order at the tail and return its slot"""
+        if self.free == NIL:
+            self._grow()
+        slot = self.free
+        self.free = self.next[slot]
+        
+        self.orders[slot] = order
+        self.prev[slot] = self.tail
+        self.next[slot] = NIL
+        if self.tail == NIL:
+            self.head = slot
+        else:
+            self.next[self.tail] = slot
+        self.tail = slot
+        self.count += 1
+        return slot
+
+    def remove(self, slot: int) -> None:
+        """we can Unlink the order in slot and put the slot back on the free list"""
+        prev_slot = self.prev[slot]
+        next_slot = self.next[slot]
+        if prev_slot == NIL:
+            self.head = next_slot
+        else:
+            self.next[prev_slot] = next_slot
+        if next_slot == NIL:
+            self.tail = prev_slot
+        else:
+            self.prev[next_slot] = prev_slot
+        
+        self.orders[slot] = None
+        self.next[slot] = self.free
+        self.free = slot
+        self.count -= 1
+
+    def _grow(self) -> None:
+        capacity = len(self.orders)
+        self.orders.extend([None] * capacity)
+        self.next.extend(list(range(capacity + 1, 2 * capacity)) + [NIL])
+        self.prev.extend([NIL] * capacity)
+        self.free = capacity
 
 class OrderBook:
     def __init__(self, symbol: str):
         self.symbol = symbol
-        self.bids: Dict[Decimal, List[Order]] = {}  # price -> list of orders
-        self.asks: Dict[Decimal, List[Order]] = {}  # price -> list of orders
-        self.order_map: Dict[str, Order] = {}  # order_id -> order
+        self.bids: SortedDict = SortedDict()  # price -> PriceLevel, ascending
+        self.asks: SortedDict = SortedDict()  # price -> PriceLevel, ascending
+        self.order_map: Dict[int, Tuple[PriceLevel, int]] = {}  # order_id -> (level, slot)
+        # we can Keep each level's resting quantity so depth views skip summing orders
+        self.bid_volumes: Dict[int, int] = {}  # price -> total quantity
+        self.ask_volumes: Dict[int, int] = {}  # price -> total quantity
+        # we can Cache the top of book so BBO queries skip the level index
+        self._best_bid: Optional[int] = None
+        self._best_ask: Optional[int] = None
+        # we can Keep the best DEPTH_LEVELS prices per side, best first, for depth snapshots
+        self.top_bids: List[int] = []
+        self.top_asks: List[int] = []
 
-    def get_bbo(self) -> Tuple[Optional[Decimal], Optional[Decimal]]:
+    def get_bbo(self) -> Tuple[Optional[int], Optional[int]]:
         """Get Best Bid and Offer"""
-        best_bid = max(self.bids.keys()) if self.bids else None
-        best_ask = min(self.asks.keys()) if self.asks else None
-        return best_bid, best_ask
+        return self._best_bid, self._best_ask
 
-    def add_order(self, order: Order) -> List[Tuple[Order, Order, Decimal, Decimal]]:
+    def get_depth(self, levels: int = DEPTH_LEVELS) -> Tuple[List[Tuple[int, int]], List[Tuple[int, int]]]:
+        """
+        we can Get the top price levels per side as (price, quantity) pairs, best first
+        At most DEPTH_LEVELS levels are kept per side
+        """
+        bids = [(price, self.bid_volumes[price]) for price in self.top_bids[:levels]]
+        asks = [(price, self.ask_volumes[price]) for price in self.top_asks[:levels]]
+        return bids, asks
+
+    def add_order(self, order: Order, executions: Optional[List[Execution]] = None) -> List[Execution]:
         """
         Add an order to the book and return list of executions
+        Fills are appended to executions when a buffer is passed in
         Returns: List of (maker_order, taker_order, price, quantity) tuples
+        Raises ValueError, before touching the book, for a limit order without a price
         """
-        executions = []
+        if order.order_type == "limit" and order.price is None:
+            raise ValueError("limit order requires a price")
         
-        if order.side == "buy":
-            # Try to match against asks
-            while order.quantity > 0 and self.asks:
-                best_ask = min(self.asks.keys())
-                if order.order_type == "limit" and order.price < best_ask:
-                    break
-                
-                matching_orders = self.asks[best_ask]
-                for maker_order in matching_orders:
-                    if order.quantity <= 0:
-                        break
-                    
-                    execution_qty = min(order.quantity, maker_order.quantity)
-                    executions.append((maker_order, order, best_ask, execution_qty))
-                    
-                    maker_order.quantity -= execution_qty
-                    order.quantity -= execution_qty
-                    
-                    if maker_order.quantity <= 0:
-                        self.order_map.pop(maker_order.order_id)
-                
-                # we can Clean up empty price levels
-                self.asks[best_ask] = [o for o in matching_orders if o.quantity > 0]
-                if not self.asks[best_ask]:
-                    del self.asks[best_ask]
-                
-                if order.order_type in ["ioc", "fok"] and order.quantity > 0:
-                    return executions
-                
-        else:  # sell
-            # we can Try to match against bids
-            while order.quantity > 0 and self.bids:
-                best_bid = max(self.bids.keys())
-                if order.order_type == "limit" and order.price > best_bid:
-                    break
-                
-                matching_orders = self.bids[best_bid]
-                for maker_order in matching_orders:
-                    if order.quantity <= 0:
-                        break
-                    
-                    execution_qty = min(order.quantity, maker_order.quantity)
-                    executions.append((maker_order, order, best_bid, execution_qty))
-                    
-                    maker_order.quantity -= execution_qty
-                    order.quantity -= execution_qty
-                    
-                    if maker_order.quantity <= 0:
-                        self.order_map.pop(maker_order.order_id)
-                
-                # we can Clean up empty price levels
-                self.bids[best_bid] = [o for o in matching_orders if o.quantity > 0]
-                if not self.bids[best_bid]:
-                    del self.bids[best_bid]
-                
-                if order.order_type in ["ioc", "fok"] and order.quantity > 0:
-                    return executions
+        if executions is None:
+            executions = []
+        
+        # we can Reject a FOK up front unless it can be filled completely
+        if order.order_type == "fok" and not self._can_fill(order):
+            return executions
+        
+        self._match(order, executions)
         
         # we can If order still has quantity and is a limit order, add to book
         if order.quantity > 0 and order.order_type == "limit":
-            if order.side == "buy":
-                if order.price not in self.bids:
-                    self.bids[order.price] = []
-                self.bids[order.price].append(order)
-            else:
-                if order.price not in self.asks:
-                    self.asks[order.price] = []
-                self.asks[order.price].append(order)
-            self.order_map[order.order_id] = order
+            levels = self.bids if order.side == "buy" else self.asks
+            volumes = self.bid_volumes if order.side == "buy" else self.ask_volumes
+            level = levels.get(order.price)
+            if level is None:
+                level = self._insert_level(order.side, order.price)
+            slot = level.append(order)
+            volumes[order.price] += order.quantity
+            self.order_map[order.order_id] = (level, slot)
         
         return executions
 
-    def cancel_order(self, order_id: str) -> bool:
-        """we can Cancel an order from the book"""
-        if order_id not in self.order_map:
-            return False
+    def _insert_level(self, side: str, price: int) -> PriceLevel:
+        """we can Open an empty price level and splice it into the cached top of book"""
+        level = PriceLevel()
+        if side == "buy":
+            self.bids[price] = level
+            self.bid_volumes[price] = 0
+            top = self.top_bids
+            index = 0
+            while index < len(top) and top[index] > price:
+                index += 1
+        else:
+            self.asks[price] = level
+            self.ask_volumes[price] = 0
+            top = self.top_asks
+            index = 0
+            while index < len(top) and top[index] < price:
+                index += 1
+        
+        if index < DEPTH_LEVELS:
+            top.insert(index, price)
+            if len(top) > DEPTH_LEVELS:
+                top.pop()
+        if side == "buy":
+            self._best_bid = top[0]
+        else:
+            self._best_ask = top[0]
+        return level
+
+    def _remove_level(self, side: str, price: int) -> None:
+        """we can Drop an empty price level, refilling the cached top of book from the index"""
+        if side == "buy":
+            levels, top = self.bids, self.top_bids
+            del self.bid_volumes[price]
+        else:
+            levels, top = self.asks, self.top_asks
+            del self.ask_volumes[price]
+        del levels[price]
         
-        order = self.order_map[order_id]
+        if price in top:
+            top.remove(price)
+            # we can Pull in the next level beyond the cached ones, if any
+            if len(levels) > len(top):
+                keys = levels.keys()
+                top.append(keys[-len(top) - 1] if side == "buy" else keys[len(top)])
+        if side == "buy":
+            self._best_bid = top[0] if top else None
+        else:
+            self._best_ask = top[0] if top else None
+
+    def _can_fill(self, order: Order) -> bool:
+        """we can Check whether resting liquidity within the order's price covers its full quantity"""
         if order.side == "buy":
-            orders = self.bids.get(order.price, [])
-            orders = [o for o in orders if o.order_id != order_id]
-            if orders:
-                self.bids[order.price] = orders
-            else:
-                del self.bids[order.price]
+            prices = self.asks.irange(None, order.price)
+            volumes = self.ask_volumes
         else:
-            orders = self.asks.get(order.price, [])
-            orders = [o for o in orders if o.order_id != order_id]
-            if orders:
-                self.asks[order.price] = orders
+            prices = self.bids.irange(order.price, None, reverse=True)
+            volumes = self.bid_volumes
+        
+        needed = order.quantity
+        for price in prices:
+            needed -= volumes[price]
+            if needed <= 0:
+                return True
+        return False
+
+    def _match(self, order: Order, executions: List[Execution]) -> None:
+        """
+        we can Match a taker order against the opposite side of the book
+        Appends fills to executions and leaves the unfilled quantity on the order
+        """
+        is_buy = order.side == "buy"
+        levels = self.asks if is_buy else self.bids
+        volumes = self.ask_volumes if is_buy else self.bid_volumes
+        maker_side = "sell" if is_buy else "buy"
+        limit = order.price if order.order_type != "market" else None
+        order_map = self.order_map
+        append = executions.append
+        remaining = order.quantity
+        
+        while remaining > 0 and levels:
+            price = self._best_ask if is_buy else self._best_bid
+            if limit is not None and (price > limit if is_buy else price < limit):
+                break
+            
+            # we can Fill makers at this level in time priority
+            level = levels[price]
+            level_remaining = remaining
+            orders = level.orders
+            while level.count and remaining > 0:
+                head = level.head
+                maker_order = orders[head]
+                maker_qty = maker_order.quantity
+                execution_qty = maker_qty if maker_qty < remaining else remaining
+                append((maker_order, order, price, execution_qty))
+                
+                maker_order.quantity = maker_qty - execution_qty
+                remaining -= execution_qty
+                
+                if maker_order.quantity == 0:
+                    level.remove(head)
+                    del order_map[maker_order.order_id]
+            
+            # we can Clean up empty price levels
+            if level.count:
+                volumes[price] -= level_remaining - remaining
             else:
-                del self.asks[order.price]
+                self._remove_level(maker_side, price)
+        
+        order.quantity = remaining
+
+    def cancel_order(self, order_id: int) -> bool:
+        """we can Cancel an order from the book"""
+        entry = self.order_map.pop(order_id, None)
+        if entry is None:
+            return False
+        
+        level, slot = entry
+        order = level.orders[slot]
+        level.remove(slot)
+        if level.count:
+            volumes = self.bid_volumes if order.side == "buy" else self.ask_volumes
+            volumes[order.price] -= order.quantity
+        else:
+            self._remove_level(order.side, order.price)
         
-        del self.order_map[order_id]
         return True
 
 class MatchingEngine:
-    def __init__(self):
+    def __init__(self, id_prefix: int = 0):
         self.order_books: Dict[str, OrderBook] = {}
+        self._exec_pool: List[List[Execution]] = []  # reusable executions buffers
+        # we can Hand out monotonic ids, (id_prefix << ORDER_ID_SHIFT) | seq, unique across prefixes
+        self._next_oid = itertools.count((id_prefix << ORDER_ID_SHIFT) | 1)
     
     def get_order_book(self, symbol: str) -> OrderBook:
         if symbol not in self.order_books:
             self.order_books[symbol] = OrderBook(symbol)
         return self.order_books[symbol]
     
+    def next_order_id(self) -> int:
+        """we can Allocate the next order id"""
+        return next(self._next_oid)
+    
     def submit_order(self, symbol: str, side: str, order_type: str, 
-                    quantity: Decimal, price: Optional[Decimal] = None) -> List[Tuple[Order, Order, Decimal, Decimal]]:
-        """we can Submit a new order to the matching engine"""
+                    quantity: Decimal, price: Optional[Decimal] = None,
+                    order_id: Optional[int] = None) -> List[Execution]:
+        """
+        we can Submit a new order to the matching engine
+        Quantity and price are scaled to lots/ticks here, amounts finer than that raise ValueError
+        Executions are returned in lots/ticks
+        The returned list is a pooled buffer, hand it back with release_executions() when done
+        Pass an id from next_order_id() to know the order's id even if nothing fills
+        """
+        lots = to_fixed(quantity, QTY_SCALE)
+        if lots <= 0:
+            raise ValueError("quantity must be at least one lot")
+        
         order = Order(
-            order_id=str(uuid.uuid4()),
+            order_id=order_id if order_id is not None else next(self._next_oid),
             symbol=symbol,
             side=side,
             order_type=order_type,
-            quantity=quantity,
-            price=price,
-            timestamp=datetime.utcnow()
+            quantity=lots,
+            price=to_fixed(price, PRICE_SCALE) if price is not None else None,
+            timestamp=time.time_ns()
         )
         
+        executions = self._exec_pool.pop() if self._exec_pool else []
+        executions.clear()
+        
         order_book = self.get_order_book(symbol)
-        return order_book.add_order(order)
+        return order_book.add_order(order, executions)
+    
+    def release_executions(self, executions: List[Execution]) -> None:
+        """we can Return an executions buffer from submit_order to the pool"""
+        if len(self._exec_pool) < EXEC_POOL_SIZE:
+            self._exec_pool.append(executions)
     
-    def cancel_order(self, symbol: str, order_id: str) -> bool:
+    def cancel_order(self, symbol: str, order_id: int) -> bool:
         """we can Cancel an existing order"""
         order_book = self.get_order_book(symbol)
         return order_book.cancel_order(order_id)
     
-    def get_bbo(self, symbol: str) -> Tuple[Optional[Decimal], Optional[Decimal]]:
-        """we can Get Best Bid and Offer for a symbol"""
+    def get_bbo(self, symbol: str) -> Tuple[Optional[int], Optional[int]]:
+        """we can Get Best Bid and Offer for a symbol, in ticks"""
         order_book = self.get_order_book(symbol)
         return order_book.get_bbo() 
\ No newline at end of file
@@ -0,0 +1,124 @@
+from concurrent.futures import ProcessPoolExecutor
+from concurrent.futures.process import BrokenProcessPool
+from decimal import Decimal
+from typing import List, Optional, Tuple
+import asyncio
+import logging
+import multiprocessing
+import os
+import zlib
+from .engine import DEPTH_LEVELS, MatchingEngine
+
+logger = logging.getLogger(__name__)
+
+# (maker_order_id, taker_order_id, aggressor_side, price, quantity)
+Fill = Tuple[int, int, str, int, int]
+# (bids, asks) as (price, quantity) pairs, best first
+Depth = Tuple[List[Tuple[int, int]], List[Tuple[int, int]]]
+
+# we can Hold the order books owned by this worker process
+_engine: Optional[MatchingEngine] = None
+
+class ShardError(RuntimeError):
+    """we can Signal that a shard worker failed and was restarted with empty order books"""
+
+def _init_worker(id_prefix: int):
+    global _engine
+    # we can Prefix order ids with the shard (and restart count) so they stay unique across workers
+    _engine = MatchingEngine(id_prefix=id_prefix)
+
+def _submit_order(symbol: str, side: str, order_type: str,
+                  quantity: Decimal, price: Optional[Decimal]) -> Tuple[int, List[Fill], Depth]:
+    order_id = _engine.next_order_id()
+    executions = _engine.submit_order(symbol, side, order_type, quantity, price, order_id=order_id)
+    try:
+        fills = [(maker.order_id, taker.order_id, taker.side, price, qty)
+                 for maker, taker, price, qty in executions]
+    finally:
+        _engine.release_executions(executions)
+    return order_id, fills, _engine.get_order_book(symbol).get_depth(DEPTH_LEVELS)
+
+def _cancel_order(symbol: str, order_id: int) -> Tuple[bool, Depth]:
+    success = _engine.cancel_order(symbol, order_id)
+    return success, _engine.get_order_book(symbol).get_depth(DEPTH_LEVELS)
+
+def _get_bbo(symbol: str) -> Tuple[Optional[int], Optional[int]]:
+    return _engine.get_bbo(symbol)
+
+class ShardedEngine:
+    """
+    we can Spread order books over worker processes, routing each symbol to a fixed shard
+    Every shard is a single worker, so operations on one symbol still run in submission order
+    while different shards match in parallel
+    
+    Order books live only in the workers. If a worker dies, or raises anything other than a
+    ValueError for a rejected order (which leaves its book possibly half-updated), the shard
+    is restarted with empty books and the call raises ShardError
+    """
+    def __init__(self, shards: Optional[int] = None):
+        self._context = multiprocessing.get_context("spawn")
+        self._shard_count = shards or os.cpu_count() or 1
+        self._restarts = 0
+        self.shards = [self._start_shard(shard_id) for shard_id in range(self._shard_count)]
+
+    def _start_shard(self, shard_id: int) -> ProcessPoolExecutor:
+        # we can Give every worker incarnation its own id prefix so restarted shards never reuse ids
+        id_prefix = self._restarts * self._shard_count + shard_id
+        return ProcessPoolExecutor(max_workers=1, mp_context=self._context,
+                                   initializer=_init_worker, initargs=(id_prefix,))
+
+    def _restart_shard(self, shard_id: int) -> None:
+        self._restarts += 1
+        old = self.shards[shard_id]
+        self.shards[shard_id] = self._start_shard(shard_id)
+        # we can Drop calls still queued for the old worker, their books are gone
+        old.shutdown(wait=False, cancel_futures=True)
+
+    def _lost(self, shard_id: int) -> ShardError:
+        return ShardError(f"shard {shard_id} failed and was restarted; its order books were lost")
+
+    async def _call(self, symbol: str, fn, *args):
+        shard_id = zlib.crc32(symbol.encode()) % len(self.shards)
+        shard = self.shards[shard_id]
+        try:
+            result = await asyncio.wrap_future(shard.submit(fn, *args))
+        except ValueError:
+            raise
+        except asyncio.CancelledError:
+            # we can Tell a call cancelled by a restart apart from the caller being cancelled
+            if self.shards[shard_id] is shard:
+                raise
+            raise self._lost(shard_id) from None
+        except BrokenProcessPool as exc:
+            logger.error("shard %d worker died, restarting it with empty order books", shard_id)
+            failure = exc
+        except Exception as exc:
+            logger.exception("shard %d failed on %s, restarting it with empty order books", shard_id, fn.__name__)
+            failure = exc
+        else:
+            # we can Discard results from a worker that was replaced meanwhile, they changed lost books
+            if self.shards[shard_id] is not shard:
+                raise self._lost(shard_id)
+            return result
+        
+        # we can Restart once even if several calls saw the same failure
+        if self.shards[shard_id] is shard:
+            self._restart_shard(shard_id)
+        raise self._lost(shard_id) from failure
+
+    async def submit_order(self, symbol: str, side: str, order_type: str,
+                           quantity: Decimal, price: Optional[Decimal] = None) -> Tuple[int, List[Fill], Depth]:
+        """we can Submit an order on the symbol's shard, returning its id, its fills and the new depth"""
+        return await self._call(symbol, _submit_order, symbol, side, order_type, quantity, price)
+
+    async def cancel_order(self, symbol: str, order_id: int) -> Tuple[bool, Depth]:
+        """we can Cancel an order on the symbol's shard, returning success and the new depth"""
+        return await self._call(symbol, _cancel_order, symbol, order_id)
+
+    async def get_bbo(self, symbol: str) -> Tuple[Optional[int], Optional[int]]:
+        """we can Get Best Bid and Offer for a symbol, in ticks"""
+        return await self._call(symbol, _get_bbo, symbol)
+
+    def close(self):
+        for shard in self.shards:
+            shard.shutdown()
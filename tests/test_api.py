@@ -0,0 +1,133 @@
+import pytest
+import asyncio
+import orjson
+from fastapi.testclient import TestClient
+from matching_engine import api
+from matching_engine.api import app
+
+@pytest.fixture(scope="module")
+def client():
+    with TestClient(app) as client:
+        yield client
+
+@pytest.mark.parametrize("body", [
+    {"symbol": "BTC-USDT", "order_type": "limit", "side": "buy", "quantity": "1.0"},
+    {"symbol": "BTC-USDT", "order_type": "limit", "side": "bid", "quantity": "1.0", "price": "50000.0"},
+    {"symbol": "BTC-USDT", "order_type": "stop", "side": "buy", "quantity": "1.0", "price": "50000.0"},
+    {"symbol": "BTC-USDT", "order_type": "market", "side": "buy", "quantity": "0"},
+    {"symbol": "BTC-USDT", "order_type": "market", "side": "buy", "quantity": "NaN"},
+    {"symbol": "BTC-USDT", "order_type": "limit", "side": "buy", "quantity": "1.0", "price": "-1"},
+    {"symbol": "BTC-USDT", "order_type": "market", "side": "buy", "quantity": "1E+999999"},
+    {"symbol": "BTC-USDT", "order_type": "market", "side": "buy", "quantity": "0.000000001"},
+    {"symbol": "BTC-USDT", "order_type": "limit", "side": "buy", "quantity": "1.0", "price": "100.000000005"},
+    {"symbol": "BTC-USDT", "side": "buy", "quantity": "1.0"},
+])
+def test_submit_order_rejects_invalid_body(client, body):
+    response = client.post("/order", json=body)
+    assert response.status_code == 422
+    assert "detail" in response.json()
+
+def test_submit_order_rejects_malformed_json(client):
+    response = client.post("/order", content=b"{not json")
+    assert response.status_code == 422
+
+def test_submit_and_cancel_order(client):
+    symbol = "API-TEST"
+    
+    # we can Rest an order and get back its real id
+    response = client.post("/order", json={
+        "symbol": symbol, "order_type": "limit", "side": "sell", "quantity": "1.0", "price": "50000.0"
+    })
+    assert response.status_code == 200
+    resting = response.json()
+    assert resting["status"] == "accepted"
+    assert client.get(f"/bbo/{symbol}").json() == {"symbol": symbol, "best_bid": None, "best_ask": "50000"}
+    
+    # we can Cancel it by that id
+    assert client.delete(f"/order/{symbol}/{resting['order_id']}").json() == {"success": True}
+    assert client.get(f"/bbo/{symbol}").json()["best_ask"] is None
+
+class FakeWebSocket:
+    def __init__(self):
+        self.frames = []
+        self.close_code = None
+    
+    async def send_bytes(self, data):
+        self.frames.append(data)
+    
+    async def close(self, code=1000, reason=None):
+        self.close_code = code
+
+def subscribe(connections, maxsize=api.CLIENT_QUEUE_SIZE):
+    websocket = FakeWebSocket()
+    api.client_queues[websocket] = asyncio.Queue(maxsize=maxsize)
+    connections.add(websocket)
+    return websocket
+
+def unsubscribe(connections, websocket):
+    connections.discard(websocket)
+    api.client_queues.pop(websocket, None)
+
+def test_client_writer_batches_messages_into_one_frame():
+    async def scenario():
+        connections = set()
+        websocket = subscribe(connections)
+        writer = asyncio.create_task(api.client_writer(websocket, api.client_queues[websocket]))
+        try:
+            # we can Send a lone message as is
+            api.fanout(connections, orjson.dumps({"n": 0}), drop_oldest=True)
+            await asyncio.sleep(api.BATCH_INTERVAL * 4)
+            
+            # we can Coalesce messages that arrive together into one multi frame
+            for n in (1, 2, 3):
+                api.fanout(connections, orjson.dumps({"n": n}), drop_oldest=True)
+            await asyncio.sleep(api.BATCH_INTERVAL * 4)
+        finally:
+            writer.cancel()
+        
+        assert [orjson.loads(frame) for frame in websocket.frames] == [
+            {"n": 0},
+            {"type": "multi", "payload": [{"n": 1}, {"n": 2}, {"n": 3}]},
+        ]
+    
+    asyncio.run(scenario())
+
+def test_fanout_sweeps_clients_without_a_queue():
+    connections = set()
+    live = subscribe(connections)
+    gone = subscribe(connections)
+    api.client_queues.pop(gone)
+    try:
+        api.fanout(connections, b"{}", drop_oldest=True)
+        assert connections == {live}
+        assert api.client_queues[live].qsize() == 1
+    finally:
+        unsubscribe(connections, live)
+
+def test_market_data_overflow_drops_oldest_snapshot():
+    websocket = subscribe(api.market_data_connections, maxsize=2)
+    try:
+        for n in range(3):
+            api.fanout(api.market_data_connections, orjson.dumps({"n": n}), drop_oldest=True)
+        queue = api.client_queues[websocket]
+        assert [orjson.loads(queue.get_nowait()) for _ in range(queue.qsize())] == [{"n": 1}, {"n": 2}]
+        assert websocket in api.market_data_connections
+    finally:
+        unsubscribe(api.market_data_connections, websocket)
+
+def test_trade_overflow_disconnects_client():
+    async def scenario():
+        websocket = subscribe(api.trade_connections, maxsize=2)
+        try:
+            for n in range(3):
+                api.broadcast_trade({"n": n})
+            
+            # we can Drop the client rather than a fill, and close it as too slow
+            assert websocket not in api.trade_connections
+            assert websocket not in api.client_queues
+            await asyncio.sleep(0)
+            assert websocket.close_code == api.SLOW_CLIENT_CLOSE_CODE
+        finally:
+            unsubscribe(api.trade_connections, websocket)
+    
+    asyncio.run(scenario())
@@ -1,6 +1,11 @@
 import pytest
+import asyncio
+import operator
+import os
+import signal
 from decimal import Decimal
-from matching_engine.engine import MatchingEngine, Order
+from matching_engine.engine import DEPTH_LEVELS, ORDER_ID_SHIFT, MatchingEngine, Order, PriceLevel, PRICE_SCALE, QTY_SCALE, from_fixed, to_fixed
+from matching_engine.shards import ShardedEngine, ShardError
 
 def test_limit_order_matching():
     engine = MatchingEngine()
@@ -26,12 +31,12 @@ def test_limit_order_matching():
     )
     assert len(executions) == 1  # Should match
     maker, taker, price, quantity = executions[0]
-    assert price == Decimal("50000.0")
-    assert quantity == Decimal("0.5")
+    assert price == to_fixed(Decimal("50000.0"), PRICE_SCALE)
+    assert quantity == to_fixed(Decimal("0.5"), QTY_SCALE)
     
     # we can Check remaining quantity
     best_bid, best_ask = engine.get_bbo(symbol)
-    assert best_bid == Decimal("50000.0")
+    assert best_bid == to_fixed(Decimal("50000.0"), PRICE_SCALE)
     assert best_ask is None
 
 def test_market_order_matching():
@@ -56,8 +61,8 @@ def test_market_order_matching():
     )
     assert len(executions) == 1
     maker, taker, price, quantity = executions[0]
-    assert price == Decimal("50000.0")
-    assert quantity == Decimal("0.5")
+    assert price == to_fixed(Decimal("50000.0"), PRICE_SCALE)
+    assert quantity == to_fixed(Decimal("0.5"), QTY_SCALE)
 
 def test_ioc_order():
     engine = MatchingEngine()
@@ -82,8 +87,8 @@ def test_ioc_order():
     )
     assert len(executions) == 1
     maker, taker, price, quantity = executions[0]
-    assert price == Decimal("50000.0")
-    assert quantity == Decimal("1.0")  # Only matched available quantity
+    assert price == to_fixed(Decimal("50000.0"), PRICE_SCALE)
+    assert quantity == to_fixed(Decimal("1.0"), QTY_SCALE)  # Only matched available quantity
 
 def test_fok_order():
     engine = MatchingEngine()
@@ -136,22 +141,24 @@ def test_price_time_priority():
         quantity=Decimal("1.5")
     )
     assert len(executions) == 2  # Should match with both sell orders
-    assert executions[0][3] == Decimal("1.0")  # First order fully filled
-    assert executions[1][3] == Decimal("0.5")  # Second order partially filled
+    assert executions[0][3] == to_fixed(Decimal("1.0"), QTY_SCALE)  # First order fully filled
+    assert executions[1][3] == to_fixed(Decimal("0.5"), QTY_SCALE)  # Second order partially filled
 
 def test_cancel_order():
     engine = MatchingEngine()
     symbol = "BTC-USDT"
     
-    # we can Add a limit order
+    # we can Add a limit order under an id we know up front
+    order_id = engine.next_order_id()
     executions = engine.submit_order(
         symbol=symbol,
         side="buy",
         order_type="limit",
         quantity=Decimal("1.0"),
-        price=Decimal("50000.0")
+        price=Decimal("50000.0"),
+        order_id=order_id
     )
-    order_id = executions[0][1].order_id if executions else None
+    assert len(executions) == 0
     
     # we can Cancel the order
     success = engine.cancel_order(symbol, order_id)
@@ -160,4 +167,476 @@ def test_cancel_order():
     # we can Verify order is gone
     best_bid, best_ask = engine.get_bbo(symbol)
     assert best_bid is None
-    assert best_ask is None 
\ No newline at end of file
+    assert best_ask is None 
+
+def test_bbo_updates_on_level_changes():
+    engine = MatchingEngine()
+    symbol = "BTC-USDT"
+    
+    # we can Build two levels on each side
+    for side, price in [("buy", "49000.0"), ("buy", "49500.0"),
+                        ("sell", "51000.0"), ("sell", "50500.0")]:
+        engine.submit_order(
+            symbol=symbol,
+            side=side,
+            order_type="limit",
+            quantity=Decimal("1.0"),
+            price=Decimal(price)
+        )
+    assert engine.get_bbo(symbol) == (
+        to_fixed(Decimal("49500.0"), PRICE_SCALE),
+        to_fixed(Decimal("50500.0"), PRICE_SCALE),
+    )
+    
+    # we can Clear the best ask level and fall back to the next one
+    engine.submit_order(
+        symbol=symbol,
+        side="buy",
+        order_type="market",
+        quantity=Decimal("1.0")
+    )
+    assert engine.get_bbo(symbol) == (
+        to_fixed(Decimal("49500.0"), PRICE_SCALE),
+        to_fixed(Decimal("51000.0"), PRICE_SCALE),
+    )
+    
+    # we can Cancel the best bid and fall back to the next one
+    book = engine.get_order_book(symbol)
+    best_bid_order = next(iter(book.bids[to_fixed(Decimal("49500.0"), PRICE_SCALE)]))
+    assert engine.cancel_order(symbol, best_bid_order.order_id)
+    assert engine.get_bbo(symbol) == (
+        to_fixed(Decimal("49000.0"), PRICE_SCALE),
+        to_fixed(Decimal("51000.0"), PRICE_SCALE),
+    )
+
+def test_cancel_middle_order_keeps_fifo():
+    engine = MatchingEngine()
+    symbol = "BTC-USDT"
+    
+    # we can Queue three sell orders at the same price
+    for qty in ["1.0", "2.0", "3.0"]:
+        engine.submit_order(
+            symbol=symbol,
+            side="sell",
+            order_type="limit",
+            quantity=Decimal(qty),
+            price=Decimal("50000.0")
+        )
+    book = engine.get_order_book(symbol)
+    first_id, middle_id, last_id = [
+        o.order_id for o in book.asks[to_fixed(Decimal("50000.0"), PRICE_SCALE)]
+    ]
+    
+    # we can Cancel the middle order
+    assert engine.cancel_order(symbol, middle_id)
+    assert not engine.cancel_order(symbol, middle_id)
+    
+    # we can Sweep the level and check the remaining orders fill in time order
+    executions = engine.submit_order(
+        symbol=symbol,
+        side="buy",
+        order_type="market",
+        quantity=Decimal("4.0")
+    )
+    assert [(maker.order_id, qty) for maker, _, _, qty in executions] == [
+        (first_id, to_fixed(Decimal("1.0"), QTY_SCALE)),
+        (last_id, to_fixed(Decimal("3.0"), QTY_SCALE)),
+    ]
+    assert engine.get_bbo(symbol) == (None, None)
+
+def test_fixed_point_round_trip():
+    # we can Convert to ticks/lots and back without losing precision
+    assert to_fixed(Decimal("50000.12345678"), PRICE_SCALE) == 5000012345678
+    assert from_fixed(5000012345678, PRICE_SCALE) == Decimal("50000.12345678")
+    assert str(from_fixed(to_fixed(Decimal("0.5"), QTY_SCALE), QTY_SCALE)) == "0.5"
+    
+    assert to_fixed(Decimal("1E+2"), PRICE_SCALE) == 100 * PRICE_SCALE
+    
+    # we can Reject anything finer than one tick/lot instead of rounding it
+    with pytest.raises(ValueError):
+        to_fixed(Decimal("100.000000005"), PRICE_SCALE)
+    with pytest.raises(ValueError):
+        to_fixed(Decimal("0.000000015"), QTY_SCALE)
+
+def test_sub_lot_quantity_rejected():
+    engine = MatchingEngine()
+    symbol = "BTC-USDT"
+    
+    for quantity in [Decimal("0.000000001"), Decimal("0")]:
+        with pytest.raises(ValueError):
+            engine.submit_order(
+                symbol=symbol,
+                side="buy",
+                order_type="limit",
+                quantity=quantity,
+                price=Decimal("50000.0")
+            )
+    assert engine.get_bbo(symbol) == (None, None)
+    assert engine.get_order_book(symbol).order_map == {}
+
+def test_executions_buffer_is_reused():
+    engine = MatchingEngine()
+    symbol = "BTC-USDT"
+    
+    engine.submit_order(
+        symbol=symbol,
+        side="sell",
+        order_type="limit",
+        quantity=Decimal("2.0"),
+        price=Decimal("50000.0")
+    )
+    first = engine.submit_order(
+        symbol=symbol,
+        side="buy",
+        order_type="market",
+        quantity=Decimal("1.0")
+    )
+    assert len(first) == 1
+    
+    # we can Hand the buffer back and get it again, emptied, on the next order
+    engine.release_executions(first)
+    second = engine.submit_order(
+        symbol=symbol,
+        side="buy",
+        order_type="limit",
+        quantity=Decimal("1.0"),
+        price=Decimal("40000.0")
+    )
+    assert second is first
+    assert second == []
+
+def test_level_volumes_track_fills_and_cancels():
+    engine = MatchingEngine()
+    symbol = "BTC-USDT"
+    price = to_fixed(Decimal("50000.0"), PRICE_SCALE)
+    
+    # we can Rest two bids at one price
+    for qty in ["1.0", "2.0"]:
+        engine.submit_order(
+            symbol=symbol,
+            side="buy",
+            order_type="limit",
+            quantity=Decimal(qty),
+            price=Decimal("50000.0")
+        )
+    book = engine.get_order_book(symbol)
+    assert book.bid_volumes[price] == to_fixed(Decimal("3.0"), QTY_SCALE)
+    
+    # we can Partially fill the level
+    engine.submit_order(
+        symbol=symbol,
+        side="sell",
+        order_type="market",
+        quantity=Decimal("1.5")
+    )
+    assert book.bid_volumes[price] == to_fixed(Decimal("1.5"), QTY_SCALE)
+    
+    # we can Cancel the last order and drop the level
+    (remaining_id,) = [o.order_id for o in book.bids[price]]
+    assert engine.cancel_order(symbol, remaining_id)
+    assert price not in book.bid_volumes
+
+def test_price_level_grows_and_reuses_slots():
+    level = PriceLevel(capacity=2)
+    orders = [
+        Order(order_id=i, symbol="BTC-USDT", side="sell", order_type="limit",
+              quantity=1, price=1, timestamp=0)
+        for i in range(5)
+    ]
+    
+    # we can Grow past the initial capacity
+    slots = [level.append(o) for o in orders]
+    assert len(level) == 5
+    assert [o.order_id for o in level] == [0, 1, 2, 3, 4]
+    
+    # we can Unlink from the head, middle and tail
+    level.remove(slots[0])
+    level.remove(slots[2])
+    level.remove(slots[4])
+    assert [o.order_id for o in level] == [1, 3]
+    
+    # we can Reuse a freed slot for the next order, still queued at the tail
+    new_order = Order(order_id=5, symbol="BTC-USDT", side="sell", order_type="limit",
+                      quantity=1, price=1, timestamp=0)
+    assert level.append(new_order) in (slots[0], slots[2], slots[4])
+    assert [o.order_id for o in level] == [1, 3, 5]
+
+def test_fok_order_fills_across_levels_or_not_at_all():
+    engine = MatchingEngine()
+    symbol = "BTC-USDT"
+    
+    # we can Spread liquidity over two ask levels
+    for price in ["50000.0", "50100.0"]:
+        engine.submit_order(
+            symbol=symbol,
+            side="sell",
+            order_type="limit",
+            quantity=Decimal("1.0"),
+            price=Decimal(price)
+        )
+    book = engine.get_order_book(symbol)
+    
+    # we can Reject a FOK whose limit only reaches the first level, leaving the book untouched
+    executions = engine.submit_order(
+        symbol=symbol,
+        side="buy",
+        order_type="fok",
+        quantity=Decimal("1.5"),
+        price=Decimal("50000.0")
+    )
+    assert executions == []
+    assert book.ask_volumes == {
+        to_fixed(Decimal("50000.0"), PRICE_SCALE): to_fixed(Decimal("1.0"), QTY_SCALE),
+        to_fixed(Decimal("50100.0"), PRICE_SCALE): to_fixed(Decimal("1.0"), QTY_SCALE),
+    }
+    
+    # we can Fill completely once the limit covers both levels
+    executions = engine.submit_order(
+        symbol=symbol,
+        side="buy",
+        order_type="fok",
+        quantity=Decimal("1.5"),
+        price=Decimal("50100.0")
+    )
+    assert [(price, qty) for _, _, price, qty in executions] == [
+        (to_fixed(Decimal("50000.0"), PRICE_SCALE), to_fixed(Decimal("1.0"), QTY_SCALE)),
+        (to_fixed(Decimal("50100.0"), PRICE_SCALE), to_fixed(Decimal("0.5"), QTY_SCALE)),
+    ]
+
+def test_get_depth():
+    engine = MatchingEngine()
+    symbol = "BTC-USDT"
+    
+    for side, price, qty in [("buy", "49000.0", "1.0"), ("buy", "49500.0", "2.0"),
+                             ("buy", "49500.0", "0.5"), ("sell", "50500.0", "1.0")]:
+        engine.submit_order(
+            symbol=symbol,
+            side=side,
+            order_type="limit",
+            quantity=Decimal(qty),
+            price=Decimal(price)
+        )
+    
+    # we can Read the best levels first on each side
+    bids, asks = engine.get_order_book(symbol).get_depth(levels=10)
+    assert bids == [
+        (to_fixed(Decimal("49500.0"), PRICE_SCALE), to_fixed(Decimal("2.5"), QTY_SCALE)),
+        (to_fixed(Decimal("49000.0"), PRICE_SCALE), to_fixed(Decimal("1.0"), QTY_SCALE)),
+    ]
+    assert asks == [
+        (to_fixed(Decimal("50500.0"), PRICE_SCALE), to_fixed(Decimal("1.0"), QTY_SCALE)),
+    ]
+    assert engine.get_order_book(symbol).get_depth(levels=1)[0] == bids[:1]
+
+def test_sharded_engine_routes_symbols_to_shards():
+    async def scenario():
+        engine = ShardedEngine(shards=2)
+        try:
+            # we can Rest an ask on two symbols, then take one of them
+            for symbol in ["BTC-USDT", "ETH-USDT"]:
+                _, fills, _ = await engine.submit_order(symbol, "sell", "limit", Decimal("1.0"), Decimal("100.0"))
+                assert fills == []
+            
+            _, fills, (bids, asks) = await engine.submit_order("BTC-USDT", "buy", "market", Decimal("0.25"))
+            assert [(side, price, qty) for _, _, side, price, qty in fills] == [
+                ("buy", to_fixed(Decimal("100.0"), PRICE_SCALE), to_fixed(Decimal("0.25"), QTY_SCALE)),
+            ]
+            assert asks == [(to_fixed(Decimal("100.0"), PRICE_SCALE), to_fixed(Decimal("0.75"), QTY_SCALE))]
+            
+            # we can Leave the other symbol's book untouched
+            assert await engine.get_bbo("ETH-USDT") == (None, to_fixed(Decimal("100.0"), PRICE_SCALE))
+            success, _ = await engine.cancel_order("ETH-USDT", 12345)
+            assert not success
+        finally:
+            engine.close()
+    
+    asyncio.run(scenario())
+
+def test_depth_refills_from_levels_beyond_top():
+    engine = MatchingEngine()
+    symbol = "BTC-USDT"
+    
+    # we can Rest one more ask level than the depth snapshot keeps
+    for i in range(DEPTH_LEVELS + 1):
+        engine.submit_order(
+            symbol=symbol,
+            side="sell",
+            order_type="limit",
+            quantity=Decimal("1.0"),
+            price=Decimal(50000 + i)
+        )
+    book = engine.get_order_book(symbol)
+    assert len(book.get_depth()[1]) == DEPTH_LEVELS
+    
+    # we can Take the best level and see the next one pulled into the snapshot
+    engine.submit_order(
+        symbol=symbol,
+        side="buy",
+        order_type="market",
+        quantity=Decimal("1.0")
+    )
+    asks = [price for price, _ in book.get_depth()[1]]
+    assert asks == [to_fixed(Decimal(50000 + i), PRICE_SCALE) for i in range(1, DEPTH_LEVELS + 1)]
+
+def test_order_ids_are_monotonic_and_prefixed():
+    engine = MatchingEngine(id_prefix=3)
+    first = engine.next_order_id()
+    assert first >> ORDER_ID_SHIFT == 3
+    assert engine.next_order_id() == first + 1
+    
+    # we can Rest an order under a preallocated id and cancel it by that id
+    order_id = engine.next_order_id()
+    executions = engine.submit_order(
+        symbol="BTC-USDT",
+        side="buy",
+        order_type="limit",
+        quantity=Decimal("1.0"),
+        price=Decimal("50000.0"),
+        order_id=order_id
+    )
+    assert executions == []
+    assert engine.cancel_order("BTC-USDT", order_id)
+
+def test_limit_order_without_price_is_rejected():
+    engine = MatchingEngine()
+    symbol = "BTC-USDT"
+    
+    engine.submit_order(
+        symbol=symbol,
+        side="sell",
+        order_type="limit",
+        quantity=Decimal("1.0"),
+        price=Decimal("100.0")
+    )
+    
+    # we can Refuse a priceless limit order without touching the book
+    with pytest.raises(ValueError):
+        engine.submit_order(
+            symbol=symbol,
+            side="buy",
+            order_type="limit",
+            quantity=Decimal("2.0")
+        )
+    book = engine.get_order_book(symbol)
+    assert book.get_depth() == ([], [(to_fixed(Decimal("100.0"), PRICE_SCALE), to_fixed(Decimal("1.0"), QTY_SCALE))])
+    
+    # we can Keep accepting bids on the symbol afterwards
+    executions = engine.submit_order(
+        symbol=symbol,
+        side="buy",
+        order_type="limit",
+        quantity=Decimal("1.0"),
+        price=Decimal("99.0")
+    )
+    assert executions == []
+    assert engine.get_bbo(symbol) == (to_fixed(Decimal("99.0"), PRICE_SCALE), to_fixed(Decimal("100.0"), PRICE_SCALE))
+
+def test_ioc_order_respects_limit_price():
+    engine = MatchingEngine()
+    symbol = "BTC-USDT"
+    
+    for price in ["50000.0", "50100.0"]:
+        engine.submit_order(
+            symbol=symbol,
+            side="sell",
+            order_type="limit",
+            quantity=Decimal("1.0"),
+            price=Decimal(price)
+        )
+    
+    # we can Fill only up to the IOC's price and drop the rest
+    executions = engine.submit_order(
+        symbol=symbol,
+        side="buy",
+        order_type="ioc",
+        quantity=Decimal("2.0"),
+        price=Decimal("50050.0")
+    )
+    assert [(price, qty) for _, _, price, qty in executions] == [
+        (to_fixed(Decimal("50000.0"), PRICE_SCALE), to_fixed(Decimal("1.0"), QTY_SCALE)),
+    ]
+    assert engine.get_bbo(symbol) == (None, to_fixed(Decimal("50100.0"), PRICE_SCALE))
+
+def test_ioc_order_sweeps_multiple_levels():
+    engine = MatchingEngine()
+    symbol = "BTC-USDT"
+    
+    for price in ["50000.0", "49900.0", "49800.0"]:
+        engine.submit_order(
+            symbol=symbol,
+            side="buy",
+            order_type="limit",
+            quantity=Decimal("1.0"),
+            price=Decimal(price)
+        )
+    
+    # we can Sweep every bid within the limit, best first, without resting the remainder
+    executions = engine.submit_order(
+        symbol=symbol,
+        side="sell",
+        order_type="ioc",
+        quantity=Decimal("2.5"),
+        price=Decimal("49800.0")
+    )
+    assert [(price, qty) for _, _, price, qty in executions] == [
+        (to_fixed(Decimal("50000.0"), PRICE_SCALE), to_fixed(Decimal("1.0"), QTY_SCALE)),
+        (to_fixed(Decimal("49900.0"), PRICE_SCALE), to_fixed(Decimal("1.0"), QTY_SCALE)),
+        (to_fixed(Decimal("49800.0"), PRICE_SCALE), to_fixed(Decimal("0.5"), QTY_SCALE)),
+    ]
+    assert engine.get_bbo(symbol) == (to_fixed(Decimal("49800.0"), PRICE_SCALE), None)
+
+def test_sharded_engine_restarts_dead_worker():
+    async def scenario():
+        engine = ShardedEngine(shards=1)
+        try:
+            order_id, _, _ = await engine.submit_order("BTC-USDT", "sell", "limit", Decimal("1.0"), Decimal("100.0"))
+            
+            # we can Kill the worker out from under the shard
+            pid = engine.shards[0].submit(os.getpid).result()
+            os.kill(pid, signal.SIGKILL)
+            with pytest.raises(ShardError):
+                await engine.get_bbo("BTC-USDT")
+            
+            # we can Keep serving on a fresh worker, with new books and ids that do not collide
+            assert await engine.get_bbo("BTC-USDT") == (None, None)
+            new_order_id, _, _ = await engine.submit_order("BTC-USDT", "sell", "limit", Decimal("1.0"), Decimal("100.0"))
+            assert new_order_id != order_id
+        finally:
+            engine.close()
+    
+    asyncio.run(scenario())
+
+def test_sharded_engine_keeps_books_on_out_of_range_amount():
+    async def scenario():
+        engine = ShardedEngine(shards=1)
+        try:
+            await engine.submit_order("BTC-USDT", "sell", "limit", Decimal("1.0"), Decimal("100.0"))
+            
+            # we can Reject the order as bad input without restarting the shard
+            with pytest.raises(ValueError):
+                await engine.submit_order("BTC-USDT", "buy", "market", Decimal("1E+999999"))
+            assert await engine.get_bbo("BTC-USDT") == (None, to_fixed(Decimal("100.0"), PRICE_SCALE))
+        finally:
+            engine.close()
+    
+    asyncio.run(scenario())
+
+def test_sharded_engine_fails_calls_queued_behind_a_failure():
+    async def scenario():
+        engine = ShardedEngine(shards=1)
+        try:
+            # we can Queue orders behind a call that fails inside the worker
+            results = await asyncio.gather(
+                engine._call("BTC-USDT", operator.truediv, 1, 0),
+                *[engine.submit_order("BTC-USDT", "sell", "limit", Decimal("1.0"), Decimal(100 + i))
+                  for i in range(5)],
+                return_exceptions=True,
+            )
+            
+            # we can Fail every queued order instead of accepting it into the lost books
+            assert all(isinstance(result, ShardError) for result in results)
+            assert await engine.get_bbo("BTC-USDT") == (None, None)
+        finally:
+            engine.close()
+    
+    asyncio.run(scenario())